@@ -1,13 +1,27 @@
-import os, json, uuid, asyncio, time
-from typing import Dict, Optional, Deque, Set, Literal
+import os, json, uuid, asyncio, time, math
+from typing import Awaitable, Callable, Dict, Optional, Deque, Set, Literal
 from dataclasses import dataclass, field
-from collections import deque
+from collections import deque, OrderedDict
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 VIDEOS = ["test_video_1.mp4","test_video_2.mp4","test_video_3.mp4","test_video_4.mp4","test_video_5.mp4","test_video_6.mp4","test_video_7.mp4"]
+BUSY_COOLDOWN = float(os.getenv("BUSY_COOLDOWN", "5"))
+MAX_HELLO_PER_SEC = int(os.getenv("MAX_HELLO_PER_SEC", "50"))
+SESSION_RATE = float(os.getenv("SESSION_RATE", "0.5"))
+SESSION_BURST = float(os.getenv("SESSION_BURST", "5"))
+OFFER_RATE = float(os.getenv("OFFER_RATE", "1"))
+OFFER_BURST = float(os.getenv("OFFER_BURST", "5"))
+GLOBAL_RATE = float(os.getenv("GLOBAL_RATE", "50"))
+GLOBAL_BURST = float(os.getenv("GLOBAL_BURST", "100"))
+MAX_QUEUE_LENGTH = int(os.getenv("MAX_QUEUE_LENGTH", "200"))
+MAX_TRACKED_CLIENTS = int(os.getenv("MAX_TRACKED_CLIENTS", "10000"))
+# число доверенных прокси перед API; 0 — X-Forwarded-For не читается
+TRUST_FORWARDED_FOR = int(os.getenv("TRUST_FORWARDED_FOR", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "1"))
 CORS = ["http://localhost:5173","https://bcs-web.online","https://www.bcs-web.online"]
 app = FastAPI()
 app.add_middleware(
@@ -46,6 +60,10 @@ class Worker:
     current_session: Optional[str] = None   
     jobs_count: int = 0              
     connected_at: float = field(default_factory=time.time)
+    draining: bool = False
+    busy_until: float = 0.0
+    # отложенный assign_if_possible по окончании busy cooldown (один на воркер)
+    reassign: Optional[asyncio.Task] = None
 
 @dataclass
 class WorkerJob:
@@ -58,6 +76,50 @@ class WorkerJob:
     worker_id: Optional[str] = None
     inflight: bool = False
     state: JobState = "queued"
+    # когда job последний раз попал в очередь (enqueue, busy, отключение воркера), по QueueManager.clock
+    queued_at: float = 0.0
+
+class TraceRecorder:
+    """
+    Компактный JSONL-трейс событий control plane для replay.py:
+    {"t": секунды от старта, "e": событие, "w"/"j"/"s"/"c": worker/job/session/client, ...}.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.f = open(path, "a", buffering=1 << 16)
+        self.t0 = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.f.write(json.dumps({"t": 0, "e": "start", "wall": time.time()}, separators=(",", ":")) + "\n")
+
+    def record(self, event: str, **fields):
+        now = time.monotonic()
+        row = {"t": round(now - self.t0, 4), "e": event}
+        row.update((k, v) for k, v in fields.items() if v is not None)
+        self.f.write(json.dumps(row, separators=(",", ":")) + "\n")
+
+    def start(self, interval: float = TRACE_FLUSH_INTERVAL):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._flush_periodically(interval))
+
+    async def _flush_periodically(self, interval: float):
+        # по таймеру, а не на следующем событии: хвост инцидента не должен
+        # висеть в буфере, если после всплеска событий процесс упадёт
+        while True:
+            await asyncio.sleep(interval)
+            self.f.flush()
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.f.flush()
+        self.f.close()
+
+
+def client_tag(ws) -> str:
+    return format(id(ws) & 0xFFFFFFFF, "x")
+
 
 @dataclass
 class QueueManager:
@@ -65,8 +127,33 @@ class QueueManager:
     queue: Deque[str] = field(default_factory=deque)              
     workers: Dict[str, Worker] = field(default_factory=dict)       
     subs: Dict[str, Set[WebSocket]] = field(default_factory=dict)   
+    session_subs: Dict[str, Set[WebSocket]] = field(default_factory=dict)
     lock: asyncio.Lock = field(default_factory=asyncio.Lock)
     session_clients: Dict[str, int] = field(default_factory=dict)
+    hellos: Deque[float] = field(default_factory=deque)
+    trace: Optional[TraceRecorder] = None
+    # часы для busy cooldown; replay.py подставляет виртуальное время трейса
+    clock: Callable[[], float] = time.time
+    sleep: Callable[[float], Awaitable[None]] = asyncio.sleep
+
+    def _trace(self, event: str, **fields):
+        if self.trace is not None:
+            self.trace.record(event, **fields)
+
+    def hello_retry_after(self) -> Optional[float]:
+        """
+        Учитывает handshake воркера. Если за последнюю секунду их больше
+        MAX_HELLO_PER_SEC, возвращает, через сколько секунд переподключаться,
+        чтобы рассосать reconnect storm после рестарта API.
+        """
+        now = time.monotonic()
+        while self.hellos and now - self.hellos[0] > 1.0:
+            self.hellos.popleft()
+        self.hellos.append(now)
+        if len(self.hellos) > MAX_HELLO_PER_SEC:
+            # чем больше стадо, тем дальше разносим повторные попытки
+            return round(len(self.hellos) / MAX_HELLO_PER_SEC, 2)
+        return None
 
     def _log_state(self, where="STATE"):
         print(
@@ -76,7 +163,7 @@ class QueueManager:
             f"session_clients={self.session_clients} "
             f"workers_sessions={{"
             + ", ".join(
-                f"{wid}:({w.current_session},{w.jobs_count})"
+                f"{wid}:({w.current_session},{w.jobs_count}{',draining' if w.draining else ''})"
                 for wid, w in self.workers.items()
             )
             + "}"
@@ -90,26 +177,77 @@ class QueueManager:
 
     async def notify_job(self, job_id: str, msg: dict):
         group = self.subs.get(job_id)
-        if not group:
+        job = self.jobs.get(job_id)
+        watchers = self.session_subs.get(job.session_id) if job else None
+        if not group and not watchers:
             return
+        targets = set(group or ()) | set(watchers or ())
         dead = []
-        data = json.dumps(msg)
-        for ws in group:
+        # job_id нужен мультиплексированным клиентам /status, /queue его просто игнорирует
+        data = json.dumps({**msg, "job_id": job_id})
+        for ws in targets:
             try:
                 await ws.send_text(data)
             except Exception:
                 dead.append(ws)
         for ws in dead:
-            group.discard(ws)
-        if group and not len(group):
+            if group:
+                group.discard(ws)
+            if watchers:
+                watchers.discard(ws)
+        if group is not None and not group:
             self.subs.pop(job_id, None)
+        if watchers is not None and not watchers:
+            self.session_subs.pop(job.session_id, None)
+
+    async def subscribe_job(self, job_id: str, ws: WebSocket) -> Optional[str]:
+        """Подписать клиента на job. Подписка держит сессию живой, как открытый /queue/{job_id}."""
+        async with self.lock:
+            job = self.jobs.get(job_id)
+            self._trace("subscribe", j=job_id, c=client_tag(ws))
+            if not job:
+                return None
+            self.subs.setdefault(job_id, set()).add(ws)
+            self.session_clients[job.session_id] = self.session_clients.get(job.session_id, 0) + 1
+            return job.session_id
+
+    def watch_session(self, session_id: str, ws: WebSocket):
+        self.session_subs.setdefault(session_id, set()).add(ws)
+
+    def unwatch_session(self, session_id: str, ws: WebSocket):
+        group = self.session_subs.get(session_id)
+        if group:
+            group.discard(ws)
+            if not group:
+                self.session_subs.pop(session_id, None)
+
+    async def unsubscribe_job(self, job_id: str, session_id: str, ws: WebSocket):
+        self._trace("unsubscribe", j=job_id, s=session_id, c=client_tag(ws))
+        group = self.subs.get(job_id)
+        if group:
+            group.discard(ws)
+            if not group:
+                self.subs.pop(job_id, None)
+
+        need_stop_session = False
+        async with self.lock:
+            if session_id in self.session_clients:
+                self.session_clients[session_id] -= 1
+                if self.session_clients[session_id] <= 0:
+                    self.session_clients.pop(session_id, None)
+                    need_stop_session = True
+
+        if need_stop_session:
+            await self.stop_session(session_id)
 
     async def broadcast_positions(self):
         for idx, jid in enumerate(self.queue):
             await self.notify_job(jid, {"type": "queue_position", "position": idx})
 
     async def enqueue(self, job: WorkerJob) -> int:
+        self._trace("offer", j=job.job_id, s=job.session_id)
         async with self.lock:
+            job.queued_at = self.clock()
             self.jobs[job.job_id] = job
             self.queue.append(job.job_id)
             print(f"[QUEUE] add job={job.job_id} session={job.session_id} file={job.filename}")
@@ -119,15 +257,28 @@ class QueueManager:
         pos = self.queue_position(job.job_id)
         return -1 if pos is None else pos
 
+    def _requeue(self, job: WorkerJob):
+        """Вернуть job в начало очереди (под self.lock)."""
+        job.inflight = False
+        job.worker_id = None
+        job.state = "queued"
+        job.queued_at = self.clock()
+        if job.job_id not in self.queue:
+            self.queue.appendleft(job.job_id)
+
     async def assign_if_possible(self):
         while True:
             async with self.lock:
                 if not self.workers or not self.queue:
                     break
-                free_workers = [w for w in self.workers.values() if w.current_session is None]
+                now = self.clock()
+                free_workers = [
+                    w for w in self.workers.values()
+                    if w.current_session is None and not w.draining and w.busy_until <= now
+                ]
                 session_workers: Dict[str, Worker] = {}
                 for w in self.workers.values():
-                    if w.current_session is not None:
+                    if w.current_session is not None and not w.draining and w.busy_until <= now:
                         session_workers[w.current_session] = w
 
                 jid = None
@@ -174,11 +325,7 @@ class QueueManager:
                     async with self.lock:
                         j = self.jobs.get(job.job_id)
                         if j:
-                            j.inflight = False
-                            j.worker_id = None
-                            j.state = "queued"
-                            if job.job_id not in self.queue:
-                                self.queue.appendleft(job.job_id)
+                            self._requeue(j)
                     continue
 
                 await w.ws.send_text(json.dumps({
@@ -201,18 +348,21 @@ class QueueManager:
                             w.current_session = None
                     j = self.jobs.get(job.job_id)
                     if j:
-                        j.inflight = False
-                        j.worker_id = None
-                        j.state = "queued"
-                        if job.job_id not in self.queue:
-                            self.queue.appendleft(job.job_id)
+                        self._requeue(j)
                 continue
 
             self._log_state("ASSIGN_LOOP")
 
         await self.broadcast_positions()
 
+    async def worker_connected(self, worker_id: str, ws: WebSocket):
+        self._trace("hello", w=worker_id)
+        async with self.lock:
+            self.workers[worker_id] = Worker(id=worker_id, ws=ws)
+        print(f"[WORKER] connected id={worker_id}")
+
     async def worker_answer(self, worker_id: str, job_id: str, sdp: str):
+        self._trace("answer", w=worker_id, j=job_id)
         print(f"[ANSWER] from worker={worker_id} job={job_id}")
         await self.notify_job(job_id, {"type": "answer", "sdp": sdp})
         async with self.lock:
@@ -222,6 +372,7 @@ class QueueManager:
         self._log_state("ON_ANSWER")
 
     async def worker_done(self, worker_id: str, job_id: str, session_id: Optional[str]):
+        self._trace("done", w=worker_id, j=job_id, s=session_id)
         print(f"[DONE] worker={worker_id} job={job_id} session={session_id}")
         await self.notify_job(job_id, {"type": "done"})
         async with self.lock:
@@ -240,21 +391,68 @@ class QueueManager:
         self._log_state("ON_DONE")
         await self.assign_if_possible()
 
+    async def worker_busy(self, worker_id: str, job_id: str, retry_after: Optional[float] = None):
+        """
+        Воркер отказал по admission control: вернуть job в начало очереди и не
+        предлагать этому воркеру новые сессии, пока не истечёт cooldown.
+        """
+        self._trace("busy", w=worker_id, j=job_id, r=retry_after)
+        cooldown = BUSY_COOLDOWN if retry_after is None else max(float(retry_after), 0.0)
+        async with self.lock:
+            j = self.jobs.get(job_id)
+            w = self.workers.get(worker_id)
+            if j:
+                self._requeue(j)
+            if w:
+                if w.jobs_count > 0:
+                    w.jobs_count -= 1
+                if w.jobs_count == 0:
+                    w.current_session = None
+                w.busy_until = self.clock() + cooldown
+        print(f"[BUSY] worker={worker_id} job={job_id} cooldown={cooldown}s")
+        self._log_state("ON_BUSY")
+        await self.assign_if_possible()
+        if cooldown > 0 and w is not None and self.workers.get(worker_id) is w:
+            if w.reassign is not None:
+                w.reassign.cancel()
+            w.reassign = asyncio.create_task(self._assign_after(cooldown))
+
+    async def _assign_after(self, delay: float):
+        await self.sleep(delay)
+        # отменяется только ожидание: начатое назначение доводим до конца
+        await asyncio.shield(self.assign_if_possible())
+
+    async def worker_draining(self, worker_id: str) -> int:
+        """
+        Воркер уходит на rolling deploy: новые job'ы ему больше не назначаются,
+        текущие сессии доигрывают, после чего воркер сам отключается.
+        """
+        self._trace("draining", w=worker_id)
+        async with self.lock:
+            w = self.workers.get(worker_id)
+            if not w:
+                return 0
+            w.draining = True
+            remaining = w.jobs_count
+        print(f"[DRAIN] worker={worker_id} remaining_jobs={remaining}")
+        self._log_state("ON_DRAIN")
+        return remaining
+
     async def worker_disconnected(self, worker_id: str):
+        self._trace("disconnect", w=worker_id)
         print(f"[WORKER] disconnected id={worker_id}")
         async with self.lock:
             w = self.workers.pop(worker_id, None)
             if not w:
                 return
+            if w.reassign is not None:
+                w.reassign.cancel()
+                w.reassign = None
 
             for jid, job in list(self.jobs.items()):
                 if job.worker_id == worker_id and job.state not in ("done", "stopping"):
                     await self.notify_job(jid, {"type": "error", "reason": "worker_disconnected"})
-                    job.inflight = False
-                    job.worker_id = None
-                    job.state = "queued"
-                    if jid not in self.queue:
-                        self.queue.appendleft(jid)
+                    self._requeue(job)
 
         self._log_state("ON_WORKER_DISCONN")
         await self.broadcast_positions()
@@ -307,8 +505,83 @@ class QueueManager:
         for jid in job_ids:
             await self.stop_job(jid)
 
+@dataclass
+class TokenBucket:
+    rate: float
+    burst: float
+    tokens: float = 0.0
+    updated: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.tokens = self.burst
+
+    def take(self, now: float) -> float:
+        """Забрать токен. Возвращает 0, если можно, иначе сколько секунд ждать."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+@dataclass
+class RateLimiter:
+    """
+    Per-client + глобальный token bucket для HTTP-эндпоинтов.
+    Отсекает перегрузку до того, как запрос создаст сессию/job и дойдёт до QueueManager.
+    """
+    name: str
+    rate: float
+    burst: float
+    global_bucket: TokenBucket
+    buckets: "OrderedDict[str, TokenBucket]" = field(default_factory=OrderedDict)
+    rejected: int = 0
+
+    def check(self, key: str) -> Optional[float]:
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > MAX_TRACKED_CLIENTS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        wait = bucket.take(now) or self.global_bucket.take(now)
+        if wait:
+            self.rejected += 1
+            return wait
+        return None
+
+
+def client_key(request: Request) -> str:
+    if TRUST_FORWARDED_FOR:
+        # левые записи присылает сам клиент; адрес, который видел ближайший
+        # к нам доверенный прокси, — TRUST_FORWARDED_FOR-я запись справа
+        hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if len(hops) >= TRUST_FORWARDED_FOR:
+            return hops[-TRUST_FORWARDED_FOR]
+    return request.client.host if request.client else "unknown"
+
+
+def rate_limited(limiter: RateLimiter):
+    async def dependency(request: Request):
+        wait = limiter.check(client_key(request))
+        if wait is not None:
+            raise HTTPException(429, "too many requests", headers={"Retry-After": str(math.ceil(wait))})
+    return dependency
+
+
+async def queue_not_full():
+    if len(qm.queue) >= MAX_QUEUE_LENGTH:
+        raise HTTPException(429, "queue is full", headers={"Retry-After": "5"})
+
+
 sessions: Dict[str, Session] = {}
-qm = QueueManager()
+qm = QueueManager(trace=TraceRecorder(TRACE_FILE) if TRACE_FILE else None)
+global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+session_limiter = RateLimiter("session", SESSION_RATE, SESSION_BURST, global_bucket)
+offer_limiter = RateLimiter("offer", OFFER_RATE, OFFER_BURST, global_bucket)
 
 
 
@@ -324,9 +597,17 @@ async def worker_ws(ws: WebSocket):
     except Exception:
         pass
 
-    async with qm.lock:
-        qm.workers[worker_id] = Worker(id=worker_id, ws=ws)
-    print(f"[WORKER] connected id={worker_id}")
+    retry_after = qm.hello_retry_after()
+    if retry_after is not None:
+        print(f"[WORKER] handshake storm, id={worker_id} retry_after={retry_after}s")
+        try:
+            await ws.send_text(json.dumps({"type": "retry_after", "seconds": retry_after}))
+            await ws.close(code=1013)
+        except Exception:
+            pass
+        return
+
+    await qm.worker_connected(worker_id, ws)
     try:
         await ws.send_text(json.dumps({"type": "hello_ack", "worker_id": worker_id}))
     except Exception:
@@ -343,23 +624,11 @@ async def worker_ws(ws: WebSocket):
                 await qm.worker_answer(worker_id, msg["job_id"], msg["sdp"])
             elif t == "done":
                 await qm.worker_done(worker_id, msg["job_id"], msg.get("session_id"))
+            elif t == "draining":
+                remaining = await qm.worker_draining(worker_id)
+                await ws.send_text(json.dumps({"type": "drain_ack", "jobs": remaining}))
             elif t == "busy":
-                job_id = msg.get("job_id")
-                async with qm.lock:
-                    j = qm.jobs.get(job_id)
-                    w = qm.workers.get(worker_id)
-                    if j:
-                        j.inflight = False
-                        j.worker_id = None
-                        j.state = "queued"
-                        if job_id not in qm.queue:
-                            qm.queue.appendleft(job_id)
-                    if w:
-                        if w.jobs_count > 0:
-                            w.jobs_count -= 1
-                        if w.jobs_count == 0:
-                            w.current_session = None
-                await qm.assign_if_possible()
+                await qm.worker_busy(worker_id, msg.get("job_id"), msg.get("retry_after"))
     except WebSocketDisconnect:
         pass
     except Exception as e:
@@ -371,20 +640,12 @@ async def worker_ws(ws: WebSocket):
 async def queue_ws(ws: WebSocket, job_id: str):
     await ws.accept()
 
-    async with qm.lock:
-        job = qm.jobs.get(job_id)
-        session_id = job.session_id if job else None
-
+    session_id = await qm.subscribe_job(job_id, ws)
     if session_id is None:
         await ws.send_text(json.dumps({"type": "error", "reason": "unknown_job"}))
         await ws.close()
         return
 
-    qm.subs.setdefault(job_id, set()).add(ws)
-
-    async with qm.lock:
-        qm.session_clients[session_id] = qm.session_clients.get(session_id, 0) + 1
-
     print(f"[WS] client connected job={job_id} session={session_id}")
     try:
         pos = qm.queue_position(job_id)
@@ -397,47 +658,97 @@ async def queue_ws(ws: WebSocket, job_id: str):
     except WebSocketDisconnect:
         print(f"[WS] client disconnected job={job_id} session={session_id}")
     finally:
-        group = qm.subs.get(job_id)
-        if group:
-            group.discard(ws)
-            if not group:
-                qm.subs.pop(job_id, None)
-
-        need_stop_session = False
-        async with qm.lock:
-            if session_id in qm.session_clients:
-                qm.session_clients[session_id] -= 1
-                if qm.session_clients[session_id] <= 0:
-                    qm.session_clients.pop(session_id, None)
-                    need_stop_session = True
-
-        if need_stop_session:
-            await qm.stop_session(session_id)
-
+        await qm.unsubscribe_job(job_id, session_id, ws)
         qm._log_state("WS_EXIT")
 
+@app.websocket("/status")
+async def status_ws(ws: WebSocket):
+    """
+    Один сокет на клиента вместо /queue/{job_id} на каждый job.
+    Клиент шлёт {"type": "subscribe"|"unsubscribe", "job_id": ...} или с "session_id";
+    все события приходят с полем job_id. Подписка на session_id только наблюдает
+    и, в отличие от подписки на job, не держит сессию живой.
+    """
+    await ws.accept()
+    jobs: Dict[str, str] = {}
+    watched: Set[str] = set()
+    try:
+        while True:
+            raw = await ws.receive_text()
+            try:
+                msg = json.loads(raw)
+            except ValueError:
+                continue
+            if not isinstance(msg, dict):
+                continue
+            t = msg.get("type")
+            job_id = msg.get("job_id")
+            session_id = msg.get("session_id")
+            if t == "subscribe":
+                if job_id and job_id not in jobs:
+                    sid = await qm.subscribe_job(job_id, ws)
+                    if sid is None:
+                        await ws.send_text(json.dumps({"type": "error", "reason": "unknown_job", "job_id": job_id}))
+                        continue
+                    jobs[job_id] = sid
+                    pos = qm.queue_position(job_id)
+                    await ws.send_text(json.dumps({
+                        "type": "queue_position",
+                        "position": -1 if pos is None else pos,
+                        "job_id": job_id,
+                    }))
+                if session_id and session_id not in watched:
+                    watched.add(session_id)
+                    qm.watch_session(session_id, ws)
+            elif t == "unsubscribe":
+                if job_id in jobs:
+                    await qm.unsubscribe_job(job_id, jobs.pop(job_id), ws)
+                if session_id in watched:
+                    watched.discard(session_id)
+                    qm.unwatch_session(session_id, ws)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for sid in watched:
+            qm.unwatch_session(sid, ws)
+        for jid, sid in list(jobs.items()):
+            await qm.unsubscribe_job(jid, sid, ws)
+        print(f"[WS] status client disconnected jobs={len(jobs)} sessions={len(watched)}")
+
 @app.on_event("startup")
 async def _startup():
     print("[SYS] FastAPI started")
+    if qm.trace is not None:
+        qm.trace.start()
+        print(f"[SYS] recording control-plane trace to {qm.trace.path}")
+
+@app.on_event("shutdown")
+async def _shutdown():
+    if qm.trace is not None:
+        qm.trace.close()
 
 @app.get("/videos")
 def get_videos():
     return {"videos": VIDEOS}
 
-@app.post("/session")
+@app.post("/session", dependencies=[Depends(rate_limited(session_limiter))])
 def create_session(req: CreateSessionReq):
     files = VIDEOS
     if req.filename not in files:
         raise HTTPException(404, "file not found")
-    if(len(qm.workers) == 0):
+    if not any(not w.draining for w in qm.workers.values()):
         raise HTTPException(503, "No workers connected")
-    sid = req["custom_id"] or uuid.uuid4().hex
+    sid = req.custom_id or uuid.uuid4().hex
     sessions[sid] = Session(id=sid, filename=req.filename, ammunition=req.ammunition)
     print("request:", req)
     print(f"[SESSION] created sid={sid} file={req.filename}, ammunition={sessions[sid]}")
     return {"session_id": sid, "filename": req.filename}
 
-@app.post("/session/{sid}/offer", status_code=202)
+@app.post(
+    "/session/{sid}/offer",
+    status_code=202,
+    dependencies=[Depends(rate_limited(offer_limiter)), Depends(queue_not_full)],
+)
 async def enqueue_offer(sid: str, payload: OfferReq = Body(...)):
     sess = sessions.get(sid)
     if not sess:
@@ -464,8 +775,10 @@ def health():
     return {
         "ok": True,
         "workers": len(qm.workers),
+        "workers_draining": sum(1 for w in qm.workers.values() if w.draining),
         "queue_length": len(qm.queue),
         "jobs_total": len(qm.jobs),
+        "rate_limited": {"session": session_limiter.rejected, "offer": offer_limiter.rejected},
         "sessions": len(sessions),
         "videos": VIDEOS,
     }
@@ -0,0 +1,212 @@
+"""
+Проигрывает трейс control plane (TRACE_FILE) через свежий QueueManager.
+
+    python replay.py trace.jsonl              # в записанном темпе
+    python replay.py trace.jsonl --speed 10   # в 10 раз быстрее
+    python replay.py trace.jsonl --speed 0    # так быстро, как возможно
+
+Таймеры QueueManager (busy cooldown) идут по виртуальному времени трейса,
+поэтому результат не зависит от --speed.
+"""
+import os, sys, json, time, heapq, asyncio, argparse, contextlib, io
+from typing import Dict, List, Set
+
+# иначе импорт app откроет TRACE_FILE и допишет в него свой "start"
+os.environ.pop("TRACE_FILE", None)
+import app as api
+
+
+class FakeSocket:
+    """Заглушка WebSocket: запоминает, когда воркеру ушёл offer по каждому job."""
+
+    def __init__(self, replay: "Replay"):
+        self.replay = replay
+
+    async def send_text(self, data: str):
+        msg = json.loads(data)
+        if msg.get("type") == "offer":
+            self.replay.on_offer_sent(msg["job_id"])
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+class VirtualClock:
+    """Время трейса в секундах; sleep() просыпается, когда replay доходит до нужного t."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.timers = []
+        self.seq = 0
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        fut = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.timers, (self.now + max(delay, 0.0), self.seq, fut))
+        await fut
+
+    async def advance(self, t: float):
+        while self.timers and self.timers[0][0] <= t:
+            when, _, fut = heapq.heappop(self.timers)
+            self.now = when
+            if not fut.done():
+                fut.set_result(None)
+            await settle_tasks()
+        self.now = max(self.now, t)
+
+
+async def settle_tasks(rounds: int = 20):
+    # сокеты поддельные, так что разбуженные корутины доходят до конца за несколько итераций loop
+    for _ in range(rounds):
+        await asyncio.sleep(0)
+
+
+class Replay:
+    def __init__(self, events: List[dict], speed: float):
+        self.events = events
+        self.speed = speed
+        self.clock = VirtualClock()
+        # без trace: повтор не должен писать новый трейс
+        self.qm = api.QueueManager(clock=self.clock.time, sleep=self.clock.sleep)
+        self.workers: Dict[str, FakeSocket] = {}
+        self.clients: Dict[str, FakeSocket] = {}
+        self.enqueued: Set[str] = set()
+        # job_id -> задержка каждого offer от момента, когда job (снова) встал в очередь, мс
+        self.dispatch_ms: Dict[str, List[float]] = {}
+        self.handled = 0
+
+    def on_offer_sent(self, job_id: str):
+        job = self.qm.jobs.get(job_id)
+        if job_id in self.enqueued and job is not None:
+            self.dispatch_ms.setdefault(job_id, []).append((self.clock.now - job.queued_at) * 1000)
+
+    async def apply(self, ev: dict):
+        qm = self.qm
+        e = ev["e"]
+        w, j, s, c = ev.get("w"), ev.get("j"), ev.get("s"), ev.get("c")
+        if e == "hello":
+            ws = self.workers[w] = FakeSocket(self)
+            await qm.worker_connected(w, ws)
+            await qm.assign_if_possible()
+        elif e == "disconnect":
+            await qm.worker_disconnected(w)
+        elif e == "offer":
+            self.enqueued.add(j)
+            await qm.enqueue(api.WorkerJob(job_id=j, session_id=s, filename="", payload={}))
+        elif e == "answer":
+            await qm.worker_answer(w, j, "")
+        elif e == "done":
+            await qm.worker_done(w, j, s)
+        elif e == "busy":
+            await qm.worker_busy(w, j, ev.get("r"))
+        elif e == "draining":
+            await qm.worker_draining(w)
+        elif e == "subscribe":
+            ws = self.clients.setdefault(c, FakeSocket(self))
+            await qm.subscribe_job(j, ws)
+        elif e == "unsubscribe":
+            await qm.unsubscribe_job(j, s, self.clients.setdefault(c, FakeSocket(self)))
+        else:
+            return
+        self.handled += 1
+
+    async def run(self, settle: float):
+        t0 = time.perf_counter()
+        for ev in self.events:
+            if self.speed > 0:
+                delay = t0 + ev["t"] / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self.clock.advance(ev["t"])
+            await self.apply(ev)
+            await settle_tasks()
+        elapsed = time.perf_counter() - t0
+        end = self.events[-1]["t"] if self.events else 0.0
+        await self.clock.advance(end + settle)
+        return elapsed
+
+    def report(self, elapsed: float) -> dict:
+        # каждый offer — отдельный замер: повторы после busy и отключения воркера
+        # меряются от своего возврата в очередь, а не от первого enqueue
+        lat = sorted(ms for samples in self.dispatch_ms.values() for ms in samples)
+        again = sorted(ms for samples in self.dispatch_ms.values() for ms in samples[1:])
+        qm = self.qm
+        states: Dict[str, int] = {}
+        for job in qm.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {
+            "events": self.handled,
+            "elapsed_s": round(elapsed, 3),
+            "recorded_s": self.events[-1]["t"] if self.events else 0,
+            "dispatch": {
+                "jobs": len(self.enqueued),
+                "dispatched": len(self.dispatch_ms),
+                "offers": len(lat),
+                "redispatched": sum(1 for samples in self.dispatch_ms.values() if len(samples) > 1),
+                "redispatch_p95_ms": pct(again, 95),
+                "redispatch_max_ms": round(again[-1], 3) if again else None,
+                "p50_ms": pct(lat, 50),
+                "p95_ms": pct(lat, 95),
+                "p99_ms": pct(lat, 99),
+                "max_ms": round(lat[-1], 3) if lat else None,
+            },
+            "end_state": {
+                "workers": len(qm.workers),
+                "workers_draining": sum(1 for w in qm.workers.values() if w.draining),
+                "queue": len(qm.queue),
+                "jobs": len(qm.jobs),
+                "job_states": states,
+                "session_clients": len(qm.session_clients),
+                "subs": len(qm.subs),
+            },
+        }
+
+
+def pct(values, p):
+    if not values:
+        return None
+    return round(values[min(int(len(values) * p / 100), len(values) - 1)], 3)
+
+
+def load(path: str) -> List[dict]:
+    events = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    # в один файл могут дописываться несколько запусков API — берём последний
+    starts = [i for i, ev in enumerate(events) if ev.get("e") == "start"]
+    if starts:
+        events = events[starts[-1] + 1:]
+    return events
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay a control-plane trace through a fresh QueueManager")
+    parser.add_argument("path", help="JSONL written by the API with TRACE_FILE set")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier, 0 = as fast as possible")
+    parser.add_argument("--settle", type=float, default=0.0, help="trace seconds to run timers past the last event")
+    parser.add_argument("--verbose", action="store_true", help="keep QueueManager logging")
+    args = parser.parse_args()
+
+    events = load(args.path)
+    replay = Replay(events, args.speed)
+    if args.verbose:
+        elapsed = await replay.run(args.settle)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = await replay.run(args.settle)
+    print(json.dumps(replay.report(elapsed), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,114 @@
+type StatusHandler = (msg: { type: string; job_id?: string } & Record<string, unknown>) => void
+
+// Один WebSocket /status на вкладку: все job'ы подписываются через него,
+// вместо отдельного /queue/{jobId} на каждый job.
+class StatusChannel {
+	private ws: WebSocket | null = null
+	private handlers = new Map<string, Set<StatusHandler>>()
+	private pingTimer: number | undefined
+	private reconnectTimer: number | undefined
+
+	subscribe(jobId: string, handler: StatusHandler) {
+		let group = this.handlers.get(jobId)
+		if (!group) {
+			group = new Set()
+			this.handlers.set(jobId, group)
+		}
+		group.add(handler)
+
+		if (!this.ws) {
+			this.connect()
+		} else if (this.ws.readyState === WebSocket.OPEN && group.size === 1) {
+			this.send({ type: 'subscribe', job_id: jobId })
+		}
+
+		return () => {
+			const g = this.handlers.get(jobId)
+			if (!g) return
+			g.delete(handler)
+			if (g.size === 0) {
+				this.handlers.delete(jobId)
+				this.send({ type: 'unsubscribe', job_id: jobId })
+			}
+			if (this.handlers.size === 0) {
+				this.close()
+			}
+		}
+	}
+
+	private send(msg: object) {
+		if (this.ws?.readyState === WebSocket.OPEN) {
+			this.ws.send(JSON.stringify(msg))
+		}
+	}
+
+	private connect() {
+		const wssApiLink =
+			import.meta.env.VITE_API_WSS_URL || 'wss://localhost:8000'
+		const ws = new WebSocket(`${wssApiLink}/status`)
+		this.ws = ws
+
+		ws.onopen = () => {
+			for (const jobId of this.handlers.keys()) {
+				this.send({ type: 'subscribe', job_id: jobId })
+			}
+			this.pingTimer = window.setInterval(() => {
+				this.send({ type: 'ping' })
+			}, 15000)
+		}
+
+		ws.onmessage = e => {
+			try {
+				const msg = JSON.parse(e.data)
+				const group = msg.job_id ? this.handlers.get(msg.job_id) : undefined
+				group?.forEach(h => h(msg))
+			} catch {
+				// empty
+			}
+		}
+
+		ws.onclose = () => {
+			this.clearPing()
+			if (this.ws !== ws) return
+			this.ws = null
+			if (this.handlers.size > 0) {
+				this.reconnectTimer = window.setTimeout(() => {
+					this.reconnectTimer = undefined
+					if (!this.ws && this.handlers.size > 0) this.connect()
+				}, 400)
+			}
+		}
+
+		ws.onerror = () => {
+			try {
+				ws.close()
+			} catch {
+				/* empty */
+			}
+		}
+	}
+
+	private clearPing() {
+		if (this.pingTimer !== undefined) {
+			clearInterval(this.pingTimer)
+			this.pingTimer = undefined
+		}
+	}
+
+	private close() {
+		this.clearPing()
+		if (this.reconnectTimer !== undefined) {
+			clearTimeout(this.reconnectTimer)
+			this.reconnectTimer = undefined
+		}
+		const ws = this.ws
+		this.ws = null
+		try {
+			ws?.close()
+		} catch {
+			/* empty */
+		}
+	}
+}
+
+export const statusChannel = new StatusChannel()
@@ -2,6 +2,7 @@ import { Activity, AlertCircle, CheckCircle, XCircle } from 'lucide-react'
 import { useEffect, useRef, useState } from 'react'
 import { useParams } from 'react-router-dom'
 import { apiGetOffer } from '../../api/bcsApi'
+import { statusChannel } from '../../api/statusChannel'
 import QueueScreen from '../../widgets/queueScreen/QueueScreen'
 import styles from './ActiveSession.module.css'
 
@@ -47,6 +48,15 @@ type QueueEvent =
 			logs: logs
 	  }
 
+type FrameStamp = {
+	type: 'frame'
+	seq: number
+	capture_ts: number
+	sent_ts: number
+	dc_ts: number
+	latency?: Record<string, { n: number; p50: number; p95: number; p99: number }>
+}
+
 interface Decision {
 	id: number
 	timestamp: string
@@ -58,83 +68,34 @@ function openQueue(
 	jobId: string,
 	onEvent: (e: QueueEvent) => void
 ): QueueHandle {
-	let closed = false
-	let ws: WebSocket | null = null
-	let pingTimer: number | undefined
+	let unsubscribe: (() => void) | null = null
 	let answerResolved = false
 
-	const doneAnswer = new Promise<{ sdp: string }>((resolve, reject) => {
-		const connect = () => {
-			if (closed) return
-			const wssApiLink =
-				import.meta.env.VITE_API_WSS_URL || 'wss://localhost:8000'
-			ws = new WebSocket(`${wssApiLink}/queue/${jobId}`)
-			ws.onopen = () => {
-				pingTimer = window.setInterval(() => {
-					try {
-						ws?.send('ping')
-					} catch {
-						/* empty */
-					}
-				}, 15000)
-			}
-
-			ws.onmessage = e => {
-				try {
-					const msg = JSON.parse(e.data) as QueueEvent
-					onEvent(msg)
+	const closeWS = () => {
+		unsubscribe?.()
+		unsubscribe = null
+	}
 
-					if (msg.type === 'answer' && !answerResolved) {
-						answerResolved = true
-						resolve({ sdp: msg.sdp })
-					}
-					if (msg.type === 'done') {
-						closeWS()
-					}
+	const doneAnswer = new Promise<{ sdp: string }>((resolve, reject) => {
+		unsubscribe = statusChannel.subscribe(jobId, raw => {
+			const msg = raw as unknown as QueueEvent
+			onEvent(msg)
 
-					if (msg.type === 'error') {
-						reject(new Error(msg.reason))
-						closeWS()
-					}
-				} catch {
-					// empty
-				}
+			if (msg.type === 'answer' && !answerResolved) {
+				answerResolved = true
+				resolve({ sdp: msg.sdp })
 			}
-
-			ws.onclose = () => {
-				if (pingTimer !== undefined) {
-					clearInterval(pingTimer)
-					pingTimer = undefined
-				}
-				if (!closed && !answerResolved) {
-					setTimeout(connect, 400)
-				}
+			if (msg.type === 'done') {
+				closeWS()
 			}
 
-			ws.onerror = () => {
-				try {
-					ws?.close()
-				} catch {
-					/* empty */
-				}
+			if (msg.type === 'error') {
+				reject(new Error(msg.reason))
+				closeWS()
 			}
-		}
-		connect()
+		})
 	})
 
-	const closeWS = () => {
-		closed = true
-		if (pingTimer !== undefined) {
-			clearInterval(pingTimer)
-			pingTimer = undefined
-		}
-		try {
-			ws?.close()
-		} catch {
-			/* empty */
-		}
-	}
-
 	return { doneAnswer, close: closeWS, jobId }
 }
 
@@ -184,7 +145,14 @@ async function startWebRTC(
 
 	logChannel.onmessage = ev => {
 		try {
-			const data = JSON.parse(ev.data) as { type: 'logs'; logs: logs }
+			const data = JSON.parse(ev.data) as
+				| { type: 'logs'; logs: logs }
+				| FrameStamp
+			if (data.type === 'frame') {
+				const { seq, capture_ts, sent_ts, dc_ts } = data
+				logChannel.send(JSON.stringify({ type: 'frame_ack', seq, capture_ts, sent_ts, dc_ts }))
+				return
+			}
 			if (data.type === 'logs' && data.logs) {
 				onEvent(data)
 			}
@@ -0,0 +1,72 @@
+import os, asyncio
+from typing import Dict, Optional, Tuple
+
+import psutil
+
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "4"))
+MAX_CPU_PERCENT = float(os.getenv("MAX_CPU_PERCENT", "85"))
+MAX_MEM_PERCENT = float(os.getenv("MAX_MEM_PERCENT", "85"))
+MAX_DEADLINE_MISS_RATIO = float(os.getenv("MAX_DEADLINE_MISS_RATIO", "0.2"))
+BUSY_RETRY_AFTER = float(os.getenv("BUSY_RETRY_AFTER", "5"))
+CPU_SAMPLE_INTERVAL = float(os.getenv("CPU_SAMPLE_INTERVAL", "1"))
+
+
+class AdmissionBudget:
+    """
+    Решает, может ли воркер взять ещё одну сессию.
+    Новая сессия = ещё один поток обработки, поэтому смотрим на живые промахи
+    по дедлайну кадра, загрузку CPU и память.
+    """
+
+    def __init__(self, interval: float = CPU_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.cpu_percent = 0.0
+        self.task: Optional[asyncio.Task] = None
+        # первый вызов cpu_percent(None) всегда 0.0 — прогреваем счётчик
+        psutil.cpu_percent(interval=None)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._sample())
+
+    async def _sample(self):
+        # cpu_percent(None) — среднее с прошлого вызова, поэтому опрашиваем его
+        # с фиксированным шагом, а admit/snapshot читают последнее значение
+        while True:
+            await asyncio.sleep(self.interval)
+            self.cpu_percent = psutil.cpu_percent(interval=None)
+
+    def deadline_miss_ratio(self, captures: Dict) -> float:
+        misses, total = 0, 0
+        for cap in captures.values():
+            if cap.ended():
+                continue
+            window = list(getattr(cap, "deadline_misses", ()))
+            misses += sum(window)
+            total += len(window)
+        return misses / total if total else 0.0
+
+    def snapshot(self, captures: Dict) -> Dict[str, float]:
+        return {
+            "sessions": sum(1 for c in captures.values() if not c.ended()),
+            "cpu_percent": self.cpu_percent,
+            "mem_percent": psutil.virtual_memory().percent,
+            "deadline_miss_ratio": round(self.deadline_miss_ratio(captures), 3),
+        }
+
+    def admit(self, session_id: str, captures: Dict) -> Tuple[bool, Optional[str]]:
+        # подключение ещё одного зрителя к уже идущей сессии не создаёт новый поток
+        cap = captures.get(session_id)
+        if cap is not None and not cap.ended():
+            return True, None
+
+        snap = self.snapshot(captures)
+        if snap["sessions"] >= MAX_SESSIONS:
+            return False, "max_sessions"
+        if snap["deadline_miss_ratio"] > MAX_DEADLINE_MISS_RATIO:
+            return False, "deadline_misses"
+        if snap["cpu_percent"] > MAX_CPU_PERCENT:
+            return False, "cpu"
+        if snap["mem_percent"] > MAX_MEM_PERCENT:
+            return False, "memory"
+        return True, None
@@ -0,0 +1,18 @@
+import os, random
+from typing import Optional
+
+RECONNECT_BASE = float(os.getenv("RECONNECT_BASE", "0.5"))
+RECONNECT_CAP = float(os.getenv("RECONNECT_CAP", "30"))
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None,
+                  base: float = RECONNECT_BASE, cap: float = RECONNECT_CAP) -> float:
+    """
+    Capped exponential backoff с full jitter, чтобы флот воркеров не
+    переподключался к перезапущенному API одновременно.
+    retry_after — подсказка сервера; ожидание растягивается на [hint, 2*hint).
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after:
+        delay = max(delay, retry_after * random.uniform(1, 2))
+    return delay
@@ -48,7 +48,14 @@ class Tracker:
         self.coordinates = {}
 
         self.last = None
+        self.last_packet = None
         self.logs = None
+        self.latency = None
+        self.lifecycle = None
+        self.task = None
+        self._ended = False
+        # True — кадр не уложился в frame_dt (для admission control воркера)
+        self.deadline_misses = deque(maxlen=120)
 
         self.vehicle_real_width = {"TANK": 3.5, "IFV": 2.8, "APC": 2.5}
         self.f_mm = 8.0
@@ -572,21 +579,23 @@ class Tracker:
 
         fps = cap.get(cv2.CAP_PROP_FPS)
         self.frame_dt = 1.0 / fps if fps and fps > 1e-3 else 1 / 30.0
-        self._ended = False
 
         t0 = time.monotonic()
         frame_idx = 0
 
         try:
-            while True:
+            while not self.ended():
+                t_read = time.perf_counter()
                 ret, frame = cap.read()
-                if(self._ended):
+                decode_ms = (time.perf_counter() - t_read) * 1000
+                capture_ts = time.time()
+                if self.ended():
                     print("try to end")
                     break
                 if not ret:
                     break
 
-                
+                t_proc = time.perf_counter()
                 h, w = frame.shape[:2]
                 results = self.results(frame)
                 resutls_array = self.get_result(results, frame)
@@ -636,14 +645,23 @@ class Tracker:
                 self.draw_total_coordinates(vis, resutls_array, h, w)
                 _ = self.info_window(amount, amount_of_actions, tactic_prediction, command, priority)
 
+                self.last_packet = (frame_idx, capture_ts, vis)
                 self.last = vis
                 # возврат логов
                 self.logs = self.return_data(amount, actions, tactic_prediction, command, priority)
 
+                if self.latency is not None:
+                    self.latency.record("decode", decode_ms, frame_idx)
+                    self.latency.record("processing", (time.perf_counter() - t_proc) * 1000, frame_idx)
+
                 frame_idx += 1
                 target = t0 + frame_idx * self.frame_dt
                 delay = target - time.monotonic()
-                if delay > 0:
+                self.deadline_misses.append(delay <= 0)
+                if self.lifecycle is not None:
+                    # stop() будит поток сразу, не дожидаясь конца паузы между кадрами
+                    self.lifecycle.stop_event.wait(max(delay, 0))
+                elif delay > 0:
                     time.sleep(delay)
                 else:
                     time.sleep(0)
@@ -655,9 +673,24 @@ class Tracker:
                 cv2.destroyAllWindows()
             except Exception:
                 pass
+            if self.lifecycle is not None:
+                self.lifecycle.stop("eof")
+                print(f"[TEARDOWN] capture released session={self.lifecycle.session_id} "
+                      f"reason={self.lifecycle.reason} {self.lifecycle.teardown_ms():.1f}ms")
+
+    def ended(self):
+        return self._ended or (self.lifecycle is not None and self.lifecycle.stopped)
+
+    def release(self):
+        # вызывается после остановки потока: отпускаем буферы и модель
+        self.last = None
+        self.last_packet = None
+        self.frames.clear()
+        self.model = None
+        self.tracker = None
 
     async def start(self):
-        asyncio.create_task(asyncio.to_thread(self._run))
+        self.task = asyncio.create_task(asyncio.to_thread(self._run))
         print("hello from start1")
 
 
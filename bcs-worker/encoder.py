@@ -0,0 +1,299 @@
+import os, asyncio, fractions, threading, time
+from typing import Callable, Dict, Optional, Set, Tuple
+
+import av
+from aiortc import MediaStreamTrack, RTCRtpSender
+
+# Порядок = предпочтение при согласовании: libx264 (baseline, zerolatency)
+# заметно дешевле libvpx на том же разрешении.
+PREFERRED_CODECS = [c.strip().lower() for c in os.getenv("PREFERRED_CODECS", "video/H264,video/VP8").split(",") if c.strip()]
+SHARED_BITRATE = int(os.getenv("SHARED_BITRATE", "1500000"))
+H264_PRESET = os.getenv("H264_PRESET", "ultrafast")
+KEYFRAME_INTERVAL = float(os.getenv("KEYFRAME_INTERVAL", "2"))
+# PLI/FIR от зрителей: не чаще одного ключевого кадра за этот интервал на весь энкодер
+KEYFRAME_MIN_GAP = float(os.getenv("KEYFRAME_MIN_GAP", "0.5"))
+SUBSCRIBER_QUEUE = 30
+# перезапусков подряд после ошибки кодирования, потом зрители переходят на свой энкодер
+MAX_ENCODER_RESTARTS = 3
+VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+
+
+def prefer_cheap_codecs(transceiver):
+    """Выставить видео-трансиверу порядок кодеков из PREFERRED_CODECS (остальные и rtx — после)."""
+    caps = RTCRtpSender.getCapabilities("video").codecs
+    ordered = []
+    for mime in PREFERRED_CODECS:
+        ordered += [c for c in caps if c.mimeType.lower() == mime]
+    ordered += [c for c in caps if c not in ordered]
+    transceiver.setCodecPreferences(ordered)
+
+
+def negotiated_video_codec(pc) -> Optional[str]:
+    """mimeType видео-кодека, которым отправляет aiortc (первый не-rtx в ответе)."""
+    from aiortc.sdp import SessionDescription
+
+    desc = SessionDescription.parse(pc.localDescription.sdp)
+    for media in desc.media:
+        if media.kind != "video":
+            continue
+        for codec in media.rtp.codecs:
+            if codec.mimeType.lower() != "video/rtx":
+                return codec.mimeType.lower()
+    return None
+
+
+def forward_keyframe_requests(sender, track: "EncodedVideoTrack"):
+    """
+    aiortc на PLI/FIR только взводит флаг, который читается при кодировании Frame;
+    для готовых av.Packet он игнорируется, поэтому пробрасываем запрос в SharedEncoder.
+    """
+    send_keyframe = sender._send_keyframe
+
+    def _send_keyframe():
+        send_keyframe()
+        track.request_keyframe()
+
+    sender._send_keyframe = _send_keyframe
+
+
+class _Subscriber:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE)
+        # новому или отставшему зрителю нельзя отдавать P-кадры до ключевого
+        self.waiting_key = True
+
+
+class SharedEncoder:
+    """
+    Кодирует кадры сессии один раз для всех зрителей с одним кодеком и разрешением.
+    Каждый зритель получает av.Packet, а его RTCRtpSender только пакетизирует
+    их в RTP (encoder.pack), со своими seq/timestamp/picture_id.
+    """
+
+    def __init__(self, source, mime: str):
+        self.source = source
+        self.mime = mime
+        self.subscribers: Set[_Subscriber] = set()
+        self.codec = None
+        self.force_keyframe = True
+        self.keyframe_requested = False
+        self.last_keyframe = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.frames = 0
+        self.failures = 0
+        self.failed = False
+        # отменённый _pump не останавливает уже запущенный в executor _encode,
+        # а контексты libx264/libvpx нельзя трогать из двух потоков сразу
+        self._codec_lock = threading.Lock()
+
+    def subscribe(self) -> _Subscriber:
+        sub = _Subscriber()
+        if self.failed:
+            sub.queue.put_nowait(None)
+            return sub
+        self.subscribers.add(sub)
+        self.force_keyframe = True
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return sub
+
+    def request_keyframe(self):
+        self.keyframe_requested = True
+
+    def unsubscribe(self, sub: _Subscriber):
+        self.subscribers.discard(sub)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def close(self):
+        self.subscribers.clear()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.source.stop()
+
+    def _open(self, frame: av.VideoFrame):
+        if self.mime == "video/h264":
+            codec = av.CodecContext.create("libx264", "w")
+            codec.options = {"level": "31", "tune": "zerolatency", "preset": H264_PRESET}
+            codec.profile = "Baseline"
+        elif self.mime == "video/vp8":
+            codec = av.CodecContext.create("libvpx", "w")
+            codec.options = {"deadline": "realtime", "cpu-used": "-6", "lag-in-frames": "0"}
+        else:
+            raise ValueError(f"unsupported codec {self.mime}")
+        codec.width = frame.width
+        codec.height = frame.height
+        codec.bit_rate = SHARED_BITRATE
+        codec.pix_fmt = "yuv420p"
+        codec.framerate = fractions.Fraction(30, 1)
+        codec.time_base = fractions.Fraction(1, 30)
+        return codec
+
+    def _encode(self, frame: av.VideoFrame, keyframe: bool) -> Optional[av.Packet]:
+        with self._codec_lock:
+            return self._encode_locked(frame, keyframe)
+
+    def _encode_locked(self, frame: av.VideoFrame, keyframe: bool) -> Optional[av.Packet]:
+        if frame.format.name != "yuv420p":
+            frame = frame.reformat(format="yuv420p")
+        if self.codec is None or frame.width != self.codec.width or frame.height != self.codec.height:
+            self.codec = self._open(frame)
+            keyframe = True
+        frame.pict_type = av.video.frame.PictureType.I if keyframe else av.video.frame.PictureType.NONE
+        pts, time_base = frame.pts, frame.time_base
+        data, is_key = b"", False
+        for packet in self.codec.encode(frame):
+            data += bytes(packet)
+            is_key = is_key or packet.is_keyframe
+        if not data:
+            return None
+        out = av.Packet(data)
+        out.pts = pts
+        out.time_base = time_base or VIDEO_TIME_BASE
+        out.is_keyframe = is_key or keyframe
+        return out
+
+    async def _run(self):
+        while True:
+            try:
+                await self._pump()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                if self.failures > MAX_ENCODER_RESTARTS:
+                    print(f"[ENCODER] shared encoder {self.mime} failed: {e!r}, giving up")
+                    self._fail()
+                    return
+                print(f"[ENCODER] shared encoder {self.mime} failed: {e!r}, restart {self.failures}/{MAX_ENCODER_RESTARTS}")
+                # новый контекст кодека и ключевой кадр для всех зрителей
+                with self._codec_lock:
+                    self.codec = None
+                self.force_keyframe = True
+
+    def _fail(self):
+        """Отпустить зрителей: None в очереди переводит EncodedVideoTrack на кодирование per-peer."""
+        self.failed = True
+        self.task = None
+        for sub in list(self.subscribers):
+            while not sub.queue.empty():
+                sub.queue.get_nowait()
+            sub.queue.put_nowait(None)
+        self.subscribers.clear()
+
+    async def _pump(self):
+        loop = asyncio.get_running_loop()
+        while self.subscribers:
+            frame = await self.source.recv()
+            meta = getattr(self.source, "last_meta", (None, None))
+            now = time.monotonic()
+            since_key = now - self.last_keyframe
+            keyframe = (
+                self.force_keyframe
+                or since_key >= KEYFRAME_INTERVAL
+                or (self.keyframe_requested and since_key >= KEYFRAME_MIN_GAP)
+            )
+            self.force_keyframe = False
+            packet = await loop.run_in_executor(None, self._encode, frame, keyframe)
+            self.failures = 0
+            if packet is None:
+                continue
+            if packet.is_keyframe:
+                self.last_keyframe = now
+                self.keyframe_requested = False
+            self.frames += 1
+            for sub in list(self.subscribers):
+                if sub.waiting_key and not packet.is_keyframe:
+                    continue
+                if sub.queue.full():
+                    # зритель отстал: сбрасываем очередь и ждём следующий ключевой кадр
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    sub.waiting_key = True
+                    self.force_keyframe = True
+                    continue
+                sub.waiting_key = False
+                sub.queue.put_nowait((packet, meta))
+
+
+class EncoderHub:
+    """Общие энкодеры одной сессии по ключу (кодек, разрешение)."""
+
+    def __init__(self, source_factory: Callable[[Tuple[int, int]], MediaStreamTrack]):
+        self.source_factory = source_factory
+        self.encoders: Dict[Tuple[str, Tuple[int, int]], SharedEncoder] = {}
+
+    def get(self, mime: str, size: Tuple[int, int]) -> SharedEncoder:
+        key = (mime, size)
+        enc = self.encoders.get(key)
+        if enc is None:
+            enc = self.encoders[key] = SharedEncoder(self.source_factory(size), mime)
+            print(f"[ENCODER] new shared encoder codec={mime} size={size[0]}x{size[1]}")
+        return enc
+
+    def viewers(self) -> Dict[str, int]:
+        return {f"{m}@{w}x{h}": len(e.subscribers) for (m, (w, h)), e in self.encoders.items()}
+
+    def close(self):
+        for enc in self.encoders.values():
+            enc.close()
+        self.encoders.clear()
+
+
+class EncodedVideoTrack(MediaStreamTrack):
+    """
+    Трек зрителя, отдающий уже закодированные av.Packet из SharedEncoder.
+    Кодек известен только после согласования, поэтому attach() вызывается
+    после setLocalDescription, а recv() до этого ждёт.
+    """
+
+    kind = "video"
+
+    def __init__(self, hub: EncoderHub, size: Tuple[int, int]):
+        super().__init__()
+        self.hub = hub
+        self.size = size
+        self.encoder: Optional[SharedEncoder] = None
+        self._sub: Optional[_Subscriber] = None
+        self._attached = asyncio.Event()
+        # свой трек с сырыми кадрами, если общий энкодер сломался: RTCRtpSender
+        # сам кодирует Frame, так что пересогласование не нужно
+        self._fallback: Optional[MediaStreamTrack] = None
+        # (seq, capture_ts, sent_ts) — как у CaptureVideoTrack, для трассировки задержки
+        self.last_sent = None
+
+    def attach(self, mime: str):
+        self.encoder = self.hub.get(mime, self.size)
+        self._sub = self.encoder.subscribe()
+        self._attached.set()
+
+    def request_keyframe(self):
+        if self.encoder is not None and self._sub is not None:
+            self.encoder.request_keyframe()
+
+    async def recv(self):
+        await self._attached.wait()
+        if self._fallback is None:
+            item = await self._sub.queue.get()
+            if item is not None:
+                packet, (seq, capture_ts) = item
+                if seq is not None:
+                    self.last_sent = (seq, capture_ts, time.time())
+                return packet
+            print(f"[ENCODER] shared {self.encoder.mime} unavailable, encoding per peer")
+            self._sub = None
+            self._fallback = self.hub.source_factory(self.size)
+        frame = await self._fallback.recv()
+        self.last_sent = getattr(self._fallback, "last_sent", None)
+        return frame
+
+    def stop(self):
+        super().stop()
+        if self._fallback is not None:
+            self._fallback.stop()
+        if self.encoder is not None and self._sub is not None:
+            self.encoder.unsubscribe(self._sub)
+            self._sub = None
@@ -0,0 +1,77 @@
+import os, json, time, threading
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+LATENCY_LOG = os.getenv("LATENCY_LOG")
+# строк в буфере, после которых record() сам сбрасывает их в LATENCY_LOG
+LATENCY_FLUSH_ROWS = int(os.getenv("LATENCY_FLUSH_ROWS", "500"))
+STAGES = ("decode", "processing", "resize", "encode", "network", "capture_to_client")
+
+
+def percentile(values, p: float) -> Optional[float]:
+    if not values:
+        return None
+    data = sorted(values)
+    k = (len(data) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(data) - 1)
+    return data[lo] + (data[hi] - data[lo]) * (k - lo)
+
+
+class LatencyTrace:
+    """
+    Тайминги по стадиям медиапути для одной сессии.
+    Пишется из потока Tracker._run и из event loop, поэтому под локом.
+    """
+
+    def __init__(self, session_id: str, maxlen: int = 2000):
+        self.session_id = session_id
+        self.samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=maxlen))
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, ms: float, seq: Optional[int] = None):
+        full = False
+        with self._lock:
+            self.samples[stage].append(ms)
+            if LATENCY_LOG:
+                self._pending.append({
+                    "ts": time.time(),
+                    "session_id": self.session_id,
+                    "seq": seq,
+                    "stage": stage,
+                    "ms": round(ms, 3),
+                })
+                full = len(self._pending) >= LATENCY_FLUSH_ROWS
+        if full:
+            # без открытого канала logs или в grace-период registry сброс никто не вызовет
+            self.flush()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            snap = {s: list(v) for s, v in self.samples.items()}
+        out = {}
+        for stage, values in snap.items():
+            if not values:
+                continue
+            out[stage] = {
+                "n": len(values),
+                "p50": round(percentile(values, 50), 3),
+                "p95": round(percentile(values, 95), 3),
+                "p99": round(percentile(values, 99), 3),
+            }
+        return out
+
+    def flush(self):
+        if not LATENCY_LOG:
+            return
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            with open(LATENCY_LOG, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+        except Exception as e:
+            print(f"[LATENCY] flush failed: {e}")
@@ -0,0 +1,45 @@
+import sys, json, argparse
+from collections import defaultdict
+
+from latency import STAGES, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize per-stage latency from LATENCY_LOG")
+    parser.add_argument("path", help="JSONL file written by the worker (LATENCY_LOG)")
+    parser.add_argument("--session", help="only rows for this session_id")
+    args = parser.parse_args()
+
+    samples = defaultdict(list)
+    with open(args.path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if args.session and row.get("session_id") != args.session:
+                continue
+            samples[row["stage"]].append(float(row["ms"]))
+
+    if not samples:
+        print("no samples")
+        return 1
+
+    order = [s for s in STAGES if s in samples] + sorted(s for s in samples if s not in STAGES)
+    print(f"{'stage':<16}{'n':>8}{'p50':>10}{'p90':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for stage in order:
+        values = samples[stage]
+        print(
+            f"{stage:<16}{len(values):>8}"
+            f"{percentile(values, 50):>10.2f}{percentile(values, 90):>10.2f}"
+            f"{percentile(values, 95):>10.2f}{percentile(values, 99):>10.2f}"
+            f"{max(values):>10.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+import asyncio, threading, time
+from typing import Optional
+
+
+class SessionLifecycle:
+    """
+    Жизненный цикл одной сессии воркера.
+    stop_event читается потоком Tracker._run, ended — корутинами в event loop,
+    поэтому stop() можно вызывать из любого потока.
+    """
+
+    def __init__(self, session_id: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.session_id = session_id
+        self.loop = loop or asyncio.get_running_loop()
+        self.stop_event = threading.Event()
+        self.ended = asyncio.Event()
+        self.reason: Optional[str] = None
+        self.stop_requested_at: Optional[float] = None
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop_event.is_set()
+
+    def stop(self, reason: str):
+        if self.stop_event.is_set():
+            return
+        self.reason = reason
+        self.stop_requested_at = time.perf_counter()
+        self.stop_event.set()
+        try:
+            self.loop.call_soon_threadsafe(self.ended.set)
+        except RuntimeError:
+            # event loop уже закрыт — ждать некому
+            pass
+
+    def teardown_ms(self) -> Optional[float]:
+        if self.stop_requested_at is None:
+            return None
+        return (time.perf_counter() - self.stop_requested_at) * 1000
@@ -0,0 +1,170 @@
+import os, asyncio, time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from latency import LatencyTrace
+from lifecycle import SessionLifecycle
+
+EVICT_GRACE = float(os.getenv("CAPTURE_EVICT_GRACE", "10"))
+PENDING_STOP_TTL = float(os.getenv("PENDING_STOP_TTL", "60"))
+
+
+def capture_memory(cap) -> Dict[str, int]:
+    """Примерный объём памяти, который держит capture: кадры, клипы трекинга и веса модели."""
+    seen = set()
+    frames = 0
+
+    def add(arr):
+        nonlocal frames
+        if arr is None or id(arr) in seen:
+            return
+        seen.add(id(arr))
+        frames += getattr(arr, "nbytes", 0)
+
+    add(getattr(cap, "last", None))
+    packet = getattr(cap, "last_packet", None)
+    if packet is not None:
+        add(packet[2])
+    for clip in list(getattr(cap, "frames", {}).values()):
+        for crop in list(clip):
+            add(crop)
+
+    model = 0
+    try:
+        if getattr(cap, "model", None) is not None:
+            model = sum(p.numel() * p.element_size() for p in cap.model.parameters())
+    except Exception:
+        pass
+    return {"frames": frames, "model": model, "total": frames + model}
+
+
+@dataclass
+class CaptureEntry:
+    cap: object
+    peers: int = 0
+    created_at: float = 0.0
+    evict_task: Optional[asyncio.Task] = None
+
+
+class CaptureRegistry:
+    """
+    Captures воркера по session_id со счётчиком подключённых peer'ов.
+    Когда уходит последний peer, capture выселяется через EVICT_GRACE секунд:
+    поток обработки останавливается, кадры и ссылки на модели освобождаются.
+    """
+
+    def __init__(self, factory: Callable[[str, Dict], object], grace: float = EVICT_GRACE):
+        self.factory = factory
+        self.grace = grace
+        self.entries: Dict[str, CaptureEntry] = {}
+        # session_id -> время получения stop, пришедшего раньше capture
+        self.pending_stop: Dict[str, float] = {}
+
+    def get(self, session_id: str):
+        entry = self.entries.get(session_id)
+        return entry.cap if entry else None
+
+    def captures(self) -> Dict[str, object]:
+        return {sid: e.cap for sid, e in self.entries.items()}
+
+    async def acquire(self, session_id: str, path: str, ammunition: Dict):
+        entry = self.entries.get(session_id)
+        if entry is not None and entry.cap.ended():
+            # сессия закончилась, но capture ещё ждёт выселения — начинаем заново
+            await self.evict(session_id)
+            entry = None
+
+        if entry is None:
+            cap = self.factory(path, ammunition)
+            cap.latency = LatencyTrace(session_id)
+            cap.lifecycle = SessionLifecycle(session_id)
+            entry = CaptureEntry(cap=cap, created_at=time.time())
+            self.entries[session_id] = entry
+            self._prune_pending_stop()
+            if self.pending_stop.pop(session_id, None) is not None:
+                cap.lifecycle.stop("stop")
+            await cap.start()
+
+        if entry.evict_task is not None:
+            entry.evict_task.cancel()
+            entry.evict_task = None
+        entry.peers += 1
+        self._log("ACQUIRE", session_id)
+        return entry.cap
+
+    def release(self, session_id: str, cap):
+        entry = self.entries.get(session_id)
+        if entry is None or entry.cap is not cap:
+            # capture уже выселен или пересоздан для новой сессии
+            return
+        entry.peers = max(entry.peers - 1, 0)
+        self._log("RELEASE", session_id)
+        if entry.peers == 0 and entry.evict_task is None:
+            if cap.ended():
+                # закончившийся capture acquire() не переиспользует — держать модель и буферы незачем
+                entry.evict_task = asyncio.create_task(self.evict(session_id))
+            else:
+                entry.evict_task = asyncio.create_task(self._evict_later(session_id, entry))
+
+    async def _evict_later(self, session_id: str, entry: CaptureEntry):
+        await asyncio.sleep(self.grace)
+        if self.entries.get(session_id) is entry and entry.peers == 0:
+            entry.evict_task = None
+            await self.evict(session_id)
+
+    def stop(self, session_id: str, reason: str):
+        entry = self.entries.get(session_id)
+        if entry is not None:
+            entry.cap.lifecycle.stop(reason)
+        elif session_id:
+            self.pending_stop[session_id] = time.time()
+
+    async def evict(self, session_id: str):
+        entry = self.entries.pop(session_id, None)
+        if entry is None:
+            return
+        if entry.evict_task is not None and entry.evict_task is not asyncio.current_task():
+            entry.evict_task.cancel()
+        cap = entry.cap
+        mem = capture_memory(cap)
+        cap.lifecycle.stop("evict")
+        # дожидаемся выхода потока, прежде чем отпускать модель и буферы
+        task = getattr(cap, "task", None)
+        if task is not None:
+            try:
+                await task
+            except Exception:
+                pass
+        hub = getattr(cap, "encoders", None)
+        if hub is not None:
+            hub.close()
+        latency = getattr(cap, "latency", None)
+        if latency is not None:
+            latency.flush()
+        cap.release()
+        print(f"[REGISTRY] evict session={session_id} peers={entry.peers} freed={mem['total'] / 2**20:.1f}MiB")
+
+    async def evict_all(self, reason: str):
+        for sid, entry in list(self.entries.items()):
+            entry.cap.lifecycle.stop(reason)
+        await asyncio.gather(*(self.evict(sid) for sid in list(self.entries)))
+        self.pending_stop.clear()
+
+    def _prune_pending_stop(self):
+        now = time.time()
+        for sid, ts in list(self.pending_stop.items()):
+            if now - ts > PENDING_STOP_TTL:
+                self.pending_stop.pop(sid, None)
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        return {
+            sid: {"peers": e.peers, **capture_memory(e.cap)}
+            for sid, e in self.entries.items()
+        }
+
+    def _log(self, where: str, session_id: str):
+        entry = self.entries.get(session_id)
+        peers = entry.peers if entry else 0
+        held = sum(v["total"] for v in self.report().values())
+        print(f"[REGISTRY] {where} session={session_id} peers={peers} "
+              f"captures={len(self.entries)} held={held / 2**20:.1f}MiB")
@@ -1,15 +1,21 @@
-import os, asyncio, json, time, cv2
-from typing import Dict, Set
+import os, asyncio, json, time, signal, cv2
+from typing import Dict
 import websockets
 from fractions import Fraction
 from av import VideoFrame
 from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack, RTCConfiguration, RTCIceServer
 from deepsort_2 import Tracker
+from admission import AdmissionBudget, BUSY_RETRY_AFTER
+from registry import CaptureRegistry
+from backoff import backoff_delay
+from encoder import EncoderHub, EncodedVideoTrack, forward_keyframe_requests, prefer_cheap_codecs, negotiated_video_codec
 
 HOST_WS = os.getenv("HOST_WS", "ws://localhost:8000/worker")
 #HOST_WS = os.getenv("HOST_WS", "wss://api.bcs-web.online/worker")
 WORKER_ID = os.getenv("WORKER_ID", f"w-{int(time.time())}")
 VIDEOS_DIR = os.path.join(os.getcwd(), "videos")
+VIDEO_SIZE = (1280, 720)
+SHARED_ENCODER = os.getenv("SHARED_ENCODER", "1") == "1"
 
 print("STARTING...")
 
@@ -35,8 +41,33 @@ class CaptureVideoTrack(MediaStreamTrack):
         self.size = size
         self._pts = 0
         self._tb = Fraction(1, 90000)
+        # (seq, capture_ts, returned_at) последнего отданного кадра
+        self._returned = None
+        # (seq, capture_ts, sent_ts) последнего закодированного и отправленного кадра
+        self.last_sent = None
+        self.last_meta = (None, None)
+        self._last_seq = None
+
+    def _has_new_frame(self):
+        packet = getattr(self.capture, "last_packet", None)
+        if packet is None:
+            return getattr(self.capture, "last", None) is not None
+        return packet[0] != self._last_seq
+
+    def _mark_encoded(self):
+        # aiortc кодирует и пакетизирует кадр между вызовами recv(),
+        # поэтому время до следующего recv() считаем стадией encode
+        if self._returned is None:
+            return
+        seq, capture_ts, returned_at = self._returned
+        self._returned = None
+        latency = getattr(self.capture, "latency", None)
+        if latency is not None and seq is not None:
+            latency.record("encode", (time.perf_counter() - returned_at) * 1000, seq)
+        self.last_sent = (seq, capture_ts, time.time())
 
     async def recv(self):
+        self._mark_encoded()
         if getattr(self.capture, "ended", lambda: False)():
             vf = VideoFrame(width=640, height=360, format="bgr24")
             vf.pts = 0
@@ -44,20 +75,32 @@ class CaptureVideoTrack(MediaStreamTrack):
             await asyncio.sleep(0)
             return vf
 
-        while getattr(self.capture, "last", None) is None and not getattr(
+        # ждём новый кадр, а не отдаём тот же повторно: иначе энкодер
+        # перекодирует один и тот же кадр так быстро, как успевает
+        while not self._has_new_frame() and not getattr(
             self.capture, "ended", lambda: False
         )():
             await asyncio.sleep(0.005)
 
+        seq, capture_ts = None, None
         if getattr(self.capture, "last", None) is None and getattr(
             self.capture, "ended", lambda: False
         )():
             vf = VideoFrame(width=640, height=360, format="bgr24")
         else:
-            frame = self.capture.last
+            packet = getattr(self.capture, "last_packet", None)
+            if packet is not None:
+                seq, capture_ts, frame = packet
+                self._last_seq = seq
+            else:
+                frame = self.capture.last
+            t_resize = time.perf_counter()
             if self.size:
                 frame = cv2.resize(frame, self.size)
             vf = VideoFrame.from_ndarray(frame, format="bgr24")
+            latency = getattr(self.capture, "latency", None)
+            if latency is not None and seq is not None:
+                latency.record("resize", (time.perf_counter() - t_resize) * 1000, seq)
 
         frame_dt = max(getattr(self.capture, "frame_dt", 1 / 30), 1 / 120)
         step = int(90000 * frame_dt)
@@ -65,28 +108,14 @@ class CaptureVideoTrack(MediaStreamTrack):
         vf.pts = self._pts
         vf.time_base = self._tb
         await asyncio.sleep(0)
+        self.last_meta = (seq, capture_ts)
+        self._returned = (seq, capture_ts, time.perf_counter())
         return vf
 
-captures: Dict[str, Tracker] = {}
-pending_stop: Set[str] = set()
-
-
-async def get_or_create_capture(
-    session_id: str, filename: str, ammunition: Dict
-) -> Tracker:
-    cap = captures.get(session_id)
-    if cap is None:
-        path = os.path.join(VIDEOS_DIR, filename)
-        cap = Tracker(path, weapons=ammunition)
-        captures[session_id] = cap
-        await cap.start()
-        if session_id in pending_stop:
-            try:
-                cap._ended = True
-            except Exception:
-                pass
-            pending_stop.discard(session_id)
-    return cap
+registry = CaptureRegistry(lambda path, ammunition: Tracker(path, weapons=ammunition))
+active_jobs: Dict[str, asyncio.Task] = {}
+draining = False
+budget = AdmissionBudget()
 
 
 async def wait_ice_gathering_complete(pc: RTCPeerConnection):
@@ -102,8 +131,9 @@ async def wait_ice_gathering_complete(pc: RTCPeerConnection):
     await fut
 
 
-async def stream_logs_dc(channel, cap: Tracker):
-    while not getattr(cap, "_ended", False) and channel.readyState == "open":
+async def stream_logs_dc(channel, cap: Tracker, track: MediaStreamTrack, done: asyncio.Event):
+    tick = 0
+    while not done.is_set() and not cap.ended() and channel.readyState == "open":
         logs = getattr(cap, "logs", {})
         try:
             channel.send(
@@ -114,9 +144,45 @@ async def stream_logs_dc(channel, cap: Tracker):
                     }
                 )
             )
+            if track.last_sent is not None:
+                seq, capture_ts, sent_ts = track.last_sent
+                frame_msg = {
+                    "type": "frame",
+                    "seq": seq,
+                    "capture_ts": capture_ts,
+                    "sent_ts": sent_ts,
+                    "dc_ts": time.time(),
+                }
+                if tick % 5 == 0 and cap.latency is not None:
+                    frame_msg["latency"] = cap.latency.summary()
+                channel.send(json.dumps(frame_msg))
         except Exception:
             break
-        await asyncio.sleep(0.2)
+        tick += 1
+        if tick % 25 == 0 and cap.latency is not None:
+            cap.latency.flush()
+        try:
+            await asyncio.wait_for(done.wait(), timeout=0.2)
+        except asyncio.TimeoutError:
+            pass
+
+
+def on_frame_ack(cap: Tracker, msg: Dict):
+    # клиент эхом возвращает сообщение "frame"; половина RTT канала данных
+    # используется как оценка сетевой задержки доставки кадра.
+    # capture_to_client — от захвата до прихода в браузер, без jitter buffer,
+    # декодирования и отрисовки, и для последнего отправленного кадра, а не показанного
+    latency = getattr(cap, "latency", None)
+    dc_ts = msg.get("dc_ts")
+    if latency is None or dc_ts is None:
+        return
+    network_ms = max(time.time() - dc_ts, 0) * 1000 / 2
+    seq = msg.get("seq")
+    latency.record("network", network_ms, seq)
+    capture_ts, sent_ts = msg.get("capture_ts"), msg.get("sent_ts")
+    if capture_ts is not None and sent_ts is not None:
+        latency.record("capture_to_client", (sent_ts - capture_ts) * 1000 + network_ms, seq)
+
 async def handle_offer(
     ws,
     job_id: str,
@@ -126,21 +192,47 @@ async def handle_offer(
     ammunition: Dict,
 ):
     pc = RTCPeerConnection(configuration=ICE_CONFIG)
+    cap = None
+    track = None
+    done = asyncio.Event()
     try:
+        cap = await registry.acquire(
+            session_id, os.path.join(VIDEOS_DIR, filename), ammunition
+        )
+        if SHARED_ENCODER:
+            hub = getattr(cap, "encoders", None)
+            if hub is None:
+                hub = cap.encoders = EncoderHub(lambda size: CaptureVideoTrack(cap, size=size))
+            track = EncodedVideoTrack(hub, VIDEO_SIZE)
+        else:
+            track = CaptureVideoTrack(cap, size=VIDEO_SIZE)
+        # трансивер создаётся до setRemoteDescription: aiortc применяет
+        # предпочтения кодеков только при разборе offer
+        transceiver = pc.addTransceiver(track, direction="sendonly")
+        prefer_cheap_codecs(transceiver)
+        if isinstance(track, EncodedVideoTrack):
+            forward_keyframe_requests(transceiver.sender, track)
+
         print("await")
         await pc.setRemoteDescription(
             RTCSessionDescription(payload["sdp"], payload["type"])
         )
         print("stop await")
 
-        cap = await get_or_create_capture(session_id, filename, ammunition)
-        pc.addTrack(CaptureVideoTrack(cap, size=(1280, 720)))
-
         @pc.on("datachannel")
         def on_datachannel(channel):
             print("DataChannel created:", channel.label)
             if channel.label == "logs":
-                asyncio.create_task(stream_logs_dc(channel, cap))
+                @channel.on("message")
+                def on_message(message):
+                    try:
+                        msg = json.loads(message)
+                    except Exception:
+                        return
+                    if isinstance(msg, dict) and msg.get("type") == "frame_ack":
+                        on_frame_ack(cap, msg)
+
+                asyncio.create_task(stream_logs_dc(channel, cap, track, done))
 
 
         answer = await pc.createAnswer()
@@ -149,6 +241,19 @@ async def handle_offer(
         await pc.setLocalDescription(answer)
         await wait_ice_gathering_complete(pc)
 
+        if isinstance(track, EncodedVideoTrack):
+            mime = negotiated_video_codec(pc)
+            if mime in ("video/h264", "video/vp8"):
+                track.attach(mime)
+                print(f"[ENCODER] session={session_id} job={job_id} codec={mime} viewers={hub.viewers()}")
+            else:
+                # общий энкодер умеет только H264/VP8 — этому зрителю кодируем отдельно
+                track.stop()
+                track = CaptureVideoTrack(cap, size=VIDEO_SIZE)
+                for sender in pc.getSenders():
+                    if sender.kind == "video":
+                        sender.replaceTrack(track)
+
         print(f"Session {session_id} started with job {job_id}")
         await ws.send(
             json.dumps(
@@ -156,8 +261,6 @@ async def handle_offer(
             )
         )
 
-        done = asyncio.Event()
-
         @pc.on("iceconnectionstatechange")
         def on_ice_state_change():
             print("ICE state:", pc.iceConnectionState)
@@ -169,18 +272,34 @@ async def handle_offer(
             if pc.connectionState in ("failed", "closed", "disconnected"):
                 done.set()
 
-        async def _watch_end():
-            while not getattr(cap, "_ended", False):
-                await asyncio.sleep(0.3)
-            try:
-                await pc.close()
-            except Exception:
-                pass
-            done.set()
-
-        asyncio.create_task(_watch_end())
-        await done.wait()
+        waiters = [
+            asyncio.create_task(done.wait()),
+            asyncio.create_task(cap.lifecycle.ended.wait()),
+        ]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for w in waiters:
+                w.cancel()
     finally:
+        done.set()
+        try:
+            await pc.close()
+        except Exception:
+            pass
+        if track is not None:
+            track.stop()
+        lifecycle = getattr(cap, "lifecycle", None)
+        if lifecycle is not None and lifecycle.stopped:
+            teardown_ms = lifecycle.teardown_ms()
+            print(f"[TEARDOWN] peer closed session={session_id} job={job_id} "
+                  f"reason={lifecycle.reason} {teardown_ms:.1f}ms")
+            if cap.latency is not None:
+                cap.latency.record("teardown", teardown_ms)
+        latency = getattr(cap, "latency", None)
+        if latency is not None:
+            latency.flush()
+            print(f"[LATENCY] session={session_id} {latency.summary()}")
         try:
             await ws.send(
                 json.dumps(
@@ -193,57 +312,113 @@ async def handle_offer(
             )
         except Exception:
             pass
-        try:
-            await pc.close()
-        except Exception:
-            pass
+        if cap is not None:
+            registry.release(session_id, cap)
+
+async def drain(ws, drain_requested: asyncio.Event):
+    """
+    Ждёт SIGTERM, сообщает серверу "draining", доигрывает текущие job'ы
+    и закрывает соединение, чтобы run_worker завершился без переподключения.
+    """
+    global draining
+    await drain_requested.wait()
+    draining = True
+    print(f"[DRAIN] worker={WORKER_ID} active_jobs={len(active_jobs)}")
+    try:
+        await ws.send(json.dumps({"type": "draining", "worker_id": WORKER_ID}))
+    except Exception:
+        pass
+    while active_jobs:
+        await asyncio.wait(list(active_jobs.values()))
+    print(f"[DRAIN] worker={WORKER_ID} empty, exiting")
+    await ws.close()
+
 
 async def run_worker():
+    drain_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    budget.start()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, drain_requested.set)
+    except (NotImplementedError, RuntimeError):
+        pass
+
+    attempt = 0
+    retry_after = None
+    first = True
     while True:
+        if drain_requested.is_set() and not active_jobs:
+            return
+        if not first:
+            delay = backoff_delay(attempt, retry_after)
+            attempt += 1
+            print(f"[WORKER] reconnect in {delay:.2f}s (attempt {attempt})")
+            await asyncio.sleep(delay)
+        first = False
         try:
             async with websockets.connect(HOST_WS, max_size=None) as ws:
                 await ws.send(
                     json.dumps({"type": "hello", "worker_id": WORKER_ID})
                 )
                 try:
-                    _ = await asyncio.wait_for(ws.recv(), timeout=5)
+                    ack = json.loads(await asyncio.wait_for(ws.recv(), timeout=5))
                 except Exception:
-                    pass
+                    ack = {}
+                if ack.get("type") == "retry_after":
+                    retry_after = ack.get("seconds")
+                    print(f"[WORKER] server asked to retry after {retry_after}s")
+                    continue
+                attempt = 0
+                retry_after = None
+                drain_task = asyncio.create_task(drain(ws, drain_requested))
                 try:
                     while True:
                         msg = json.loads(await ws.recv())
                         t = msg.get("type")
                         if t == "offer":
-                            asyncio.create_task(
+                            if draining:
+                                await ws.send(json.dumps({"type": "busy", "job_id": msg["job_id"]}))
+                                continue
+                            captures = registry.captures()
+                            ok, reason = budget.admit(msg["session_id"], captures)
+                            if not ok:
+                                print(f"[ADMISSION] busy job={msg['job_id']} reason={reason} {budget.snapshot(captures)}")
+                                await ws.send(json.dumps({
+                                    "type": "busy",
+                                    "job_id": msg["job_id"],
+                                    "reason": reason,
+                                    "retry_after": BUSY_RETRY_AFTER,
+                                }))
+                                continue
+                            job_id = msg["job_id"]
+                            task = asyncio.create_task(
                                 handle_offer(
                                     ws,
-                                    msg["job_id"],
+                                    job_id,
                                     msg["session_id"],
                                     msg["filename"],
                                     msg["payload"],
                                     msg["ammunition"],
                                 )
                             )
+                            active_jobs[job_id] = task
+                            task.add_done_callback(lambda _, jid=job_id: active_jobs.pop(jid, None))
+                        elif t == "drain_ack":
+                            print(f"[DRAIN] acknowledged by server, jobs={msg.get('jobs')}")
                         elif t == "stop":
                             print("Received stop command")
                             sid = msg.get("session_id")
                             print("Stopping session:", sid)
-                            cap = captures.get(sid)
-                            try:
-                                if cap is not None:
-                                    setattr(cap, "_ended", True)
-                                    print("Set _ended for capture")
-                            except Exception:
-                                pass
+                            registry.stop(sid, "stop")
                 finally:
-                    for sid, cap in list(captures.items()):
-                        try:
-                            setattr(cap, "_ended", True)
-                        except Exception:
-                            pass
-                        captures.pop(sid, None)
-        except Exception:
-            await asyncio.sleep(1)
+                    drain_task.cancel()
+                    await registry.evict_all("disconnect")
+        except Exception as e:
+            if draining:
+                return
+            print(f"[WORKER] connection lost: {e!r}")
+        if draining:
+            return
 
 
 if __name__ == "__main__":
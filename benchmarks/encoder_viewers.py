@@ -0,0 +1,150 @@
+"""
+CPU воркера на кодирование, пока к одной сессии подключаются зрители:
+  per_peer_aiortc — энкодер aiortc на зрителя (как при SHARED_ENCODER=0);
+  per_peer_same   — энкодер на зрителя с настройками SharedEncoder (H264_PRESET);
+  shared          — один SharedEncoder + encoder.pack на зрителя.
+per_peer_aiortc vs per_peer_same — эффект пресета, per_peer_same vs shared — эффект общего кодирования.
+
+    python benchmarks/encoder_viewers.py --viewers 1 2 4 8 --frames 90
+"""
+import os, sys, json, time, argparse, fractions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bcs-worker"))
+
+import numpy as np
+import av
+from aiortc.codecs import get_encoder
+from aiortc.rtcrtpparameters import RTCRtpCodecParameters
+
+from encoder import SharedEncoder
+
+MIME = {"h264": "video/H264", "vp8": "video/VP8"}
+
+
+def make_frames(n: int, size):
+    w, h = size
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+    frames = []
+    for i in range(n):
+        # движущаяся картинка с шумом, чтобы P-кадры не были пустыми
+        img = np.roll(base, i * 8, axis=1)
+        img[::16] = (i * 7) % 255
+        f = av.VideoFrame.from_ndarray(img, format="bgr24")
+        f.pts = i * 3000
+        f.time_base = fractions.Fraction(1, 90000)
+        frames.append(f)
+    return frames
+
+
+class AiortcPerPeer:
+    """SHARED_ENCODER=0: свой энкодер aiortc (его настройки x264/libvpx) на каждого зрителя."""
+
+    def __init__(self, codec: str):
+        self.params = RTCRtpCodecParameters(mimeType=MIME[codec], clockRate=90000)
+        self.encoders = []
+
+    def add_viewer(self):
+        enc = get_encoder(self.params)
+        enc.target_bitrate = 1_500_000
+        self.encoders.append(enc)
+
+    def step(self, frame, i: int):
+        for enc in self.encoders:
+            enc.encode(frame, False)
+
+
+class SamePerPeer:
+    """Настройки SharedEncoder, но свой экземпляр на зрителя: разница с shared — только от общего кодирования."""
+
+    def __init__(self, codec: str):
+        self.codec = codec
+        self.params = RTCRtpCodecParameters(mimeType=MIME[codec], clockRate=90000)
+        self.viewers = []
+
+    def add_viewer(self):
+        self.viewers.append([SharedEncoder(source=None, mime=MIME[self.codec].lower()), get_encoder(self.params), True])
+
+    def step(self, frame, i: int):
+        for v in self.viewers:
+            enc, packer, key = v
+            v[2] = False
+            packet = enc._encode(frame, key)
+            if packet is not None:
+                packer.pack(packet)
+
+
+class Shared:
+    """SHARED_ENCODER=1: одно кодирование на сессию, encoder.pack на зрителя; новый зритель — ключевой кадр."""
+
+    def __init__(self, codec: str):
+        self.params = RTCRtpCodecParameters(mimeType=MIME[codec], clockRate=90000)
+        self.encoder = SharedEncoder(source=None, mime=MIME[codec].lower())
+        self.packers = []
+        self.keyframe = True
+
+    def add_viewer(self):
+        self.packers.append(get_encoder(self.params))
+        self.keyframe = True
+
+    def step(self, frame, i: int):
+        packet = self.encoder._encode(frame, self.keyframe)
+        self.keyframe = False
+        if packet is None:
+            return
+        for p in self.packers:
+            p.pack(packet)
+
+
+MODES = {"per_peer_aiortc": AiortcPerPeer, "per_peer_same": SamePerPeer, "shared": Shared}
+
+
+def ramp(mode: str, codec: str, frames, steps, window: int):
+    """
+    Одна сессия, зрители подключаются по ходу: после каждых window кадров
+    добавляются новые до следующего значения из steps. CPU меряется по окнам.
+    """
+    runner = MODES[mode](codec)
+    rows = []
+    i = viewers = 0
+    for n in steps:
+        while viewers < n:
+            runner.add_viewer()
+            viewers += 1
+        t0 = time.process_time()
+        for _ in range(window):
+            runner.step(frames[i % len(frames)], i)
+            i += 1
+        cpu = time.process_time() - t0
+        rows.append((n, cpu))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--viewers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--frames", type=int, default=90, help="frames measured at each viewer count")
+    parser.add_argument("--codec", choices=list(MIME), nargs="+", default=list(MIME))
+    parser.add_argument("--size", default="1280x720")
+    args = parser.parse_args()
+
+    size = tuple(int(x) for x in args.size.split("x"))
+    frames = make_frames(args.frames, size)
+    video_s = args.frames / 30
+    steps = sorted(set(args.viewers))
+    for codec in args.codec:
+        for mode in MODES:
+            for n, cpu in ramp(mode, codec, frames, steps, args.frames):
+                print(json.dumps({
+                    "codec": codec,
+                    "mode": mode,
+                    "viewers": n,
+                    "cpu_ms_per_frame": round(cpu / args.frames * 1000, 2),
+                    "cores_at_30fps": round(cpu / video_s, 2),
+                    "cores_per_viewer": round(cpu / video_s / n, 3),
+                }))
+
+
+if __name__ == "__main__":
+    main()
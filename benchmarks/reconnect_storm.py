@@ -0,0 +1,149 @@
+"""
+Reconnect storm: N воркеров подключены к API, API перезапускается,
+все воркеры переподключаются. Сравнивает плоский sleep(1) с jittered backoff.
+
+    python benchmarks/reconnect_storm.py --workers 300
+"""
+import os, sys, json, time, asyncio, argparse, socket
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bcs-api"))
+sys.path.insert(0, os.path.join(ROOT, "bcs-worker"))
+
+import uvicorn
+import websockets
+
+import app as api
+from backoff import backoff_delay
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_server(port: int):
+    config = uvicorn.Config(api.app, host="127.0.0.1", port=port, log_level="error", ws_max_size=2**20)
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def stop_server(server, task):
+    server.should_exit = True
+    await task
+
+
+class Stats:
+    def __init__(self):
+        self.attempts = []
+        self.acks = []
+        self.ack_latency = []
+        self.rejected = 0
+
+    def reset(self):
+        self.__init__()
+
+
+async def fake_worker(idx: int, url: str, policy: str, stats: Stats, stop: asyncio.Event):
+    attempt, retry_after, first = 0, None, True
+    while not stop.is_set():
+        if not first:
+            if policy == "flat":
+                delay = 1.0
+            else:
+                delay = backoff_delay(attempt, retry_after)
+            attempt += 1
+            await asyncio.sleep(delay)
+        first = False
+        try:
+            async with websockets.connect(url, max_size=None, open_timeout=5) as ws:
+                t0 = time.monotonic()
+                stats.attempts.append(t0)
+                await ws.send(json.dumps({"type": "hello", "worker_id": f"bench-{idx}"}))
+                ack = json.loads(await asyncio.wait_for(ws.recv(), timeout=5))
+                if ack.get("type") == "retry_after":
+                    stats.rejected += 1
+                    retry_after = ack.get("seconds")
+                    continue
+                stats.acks.append(time.monotonic())
+                stats.ack_latency.append((time.monotonic() - t0) * 1000)
+                attempt, retry_after = 0, None
+                while True:
+                    await ws.recv()
+        except Exception:
+            pass
+
+
+def pct(values, p):
+    if not values:
+        return float("nan")
+    data = sorted(values)
+    return data[min(int(len(data) * p / 100), len(data) - 1)]
+
+
+async def run(policy: str, n: int):
+    port = free_port()
+    url = f"ws://127.0.0.1:{port}/worker"
+    stats = Stats()
+    stop = asyncio.Event()
+
+    server, task = await start_server(port)
+    workers = [asyncio.create_task(fake_worker(i, url, policy, stats, stop)) for i in range(n)]
+    while len(api.qm.workers) < n:
+        await asyncio.sleep(0.05)
+
+    await stop_server(server, task)
+    api.qm.hellos.clear()
+    stats.reset()
+    t_restart = time.monotonic()
+    server, task = await start_server(port)
+
+    deadline = t_restart + 60
+    while len(api.qm.workers) < n and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    recovered = time.monotonic() - t_restart
+
+    stop.set()
+    for w in workers:
+        w.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await stop_server(server, task)
+
+    buckets = Counter(int((t - t_restart) * 10) for t in stats.attempts)
+    return {
+        "policy": policy,
+        "workers": n,
+        "recovered_s": round(recovered, 2),
+        "reconnected": len(stats.acks),
+        "handshakes": len(stats.attempts),
+        "rejected": stats.rejected,
+        "peak_hellos_per_100ms": max(buckets.values()) if buckets else 0,
+        "ack_p50_ms": round(pct(stats.ack_latency, 50), 2),
+        "ack_p99_ms": round(pct(stats.ack_latency, 99), 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=200)
+    parser.add_argument("--policy", choices=["flat", "jitter", "both"], default="both")
+    args = parser.parse_args()
+
+    policies = ["flat", "jitter"] if args.policy == "both" else [args.policy]
+    for policy in policies:
+        print(json.dumps(await run(policy, args.workers)))
+
+
+if __name__ == "__main__":
+    import contextlib, io
+    # app.py логирует каждое событие очереди — глушим, чтобы не мерить stdout
+    with contextlib.redirect_stdout(io.StringIO()) as buf:
+        asyncio.run(main())
+    for line in buf.getvalue().splitlines():
+        if line.startswith("{"):
+            print(line)
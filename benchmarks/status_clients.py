@@ -0,0 +1,139 @@
+"""
+Память API на одного подключённого клиента: /queue/{job_id} (сокет на job)
+против мультиплексированного /status (один сокет на клиента).
+API запускается отдельным процессом, меряется его RSS.
+
+    python benchmarks/status_clients.py --clients 200 --jobs 5
+"""
+import os, sys, json, time, asyncio, argparse, socket, subprocess, gc
+
+import httpx
+import psutil
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, "bcs-api")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def start_api(port: int, jobs: int) -> subprocess.Popen:
+    # все offer'ы идут с одного IP — лимиты admission control бенчмарк не меряет
+    env = dict(
+        os.environ,
+        OFFER_BURST=str(jobs + 10),
+        GLOBAL_BURST=str(jobs + 10),
+        MAX_QUEUE_LENGTH=str(jobs + 10),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "error"],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    async with httpx.AsyncClient() as http:
+        for _ in range(200):
+            try:
+                await http.get(f"http://127.0.0.1:{port}/health")
+                return proc
+            except httpx.HTTPError:
+                await asyncio.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("api did not start")
+
+
+async def fake_worker(url: str, ready: asyncio.Event):
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "hello", "worker_id": "bench-worker"}))
+        await ws.recv()
+        ready.set()
+        while True:
+            await ws.recv()
+
+
+async def legacy_client(base: str, job_ids, conns):
+    for jid in job_ids:
+        ws = await websockets.connect(f"{base}/queue/{jid}")
+        await ws.recv()
+        conns.append(ws)
+
+
+async def mux_client(base: str, job_ids, conns):
+    ws = await websockets.connect(f"{base}/status")
+    for jid in job_ids:
+        await ws.send(json.dumps({"type": "subscribe", "job_id": jid}))
+    for _ in job_ids:
+        await ws.recv()
+    conns.append(ws)
+
+
+async def run(mode: str, clients: int, jobs: int):
+    port = free_port()
+    proc = await start_api(port, clients * jobs)
+    try:
+        return await measure(proc, port, mode, clients, jobs)
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+async def measure(proc: subprocess.Popen, port: int, mode: str, clients: int, jobs: int):
+    server = psutil.Process(proc.pid)
+    base = f"ws://127.0.0.1:{port}"
+    ready = asyncio.Event()
+    worker = asyncio.create_task(fake_worker(f"{base}/worker", ready))
+    await ready.wait()
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as http:
+        r = await http.post("/session", json={
+            "filename": "test_video_1.mp4", "ammunition": {}, "custom_id": None,
+        })
+        sid = r.json()["session_id"]
+        job_ids = []
+        for _ in range(clients * jobs):
+            r = await http.post(f"/session/{sid}/offer", json={"sdp": "v=0", "type": "offer"})
+            r.raise_for_status()
+            job_ids.append(r.json()["job_id"])
+
+    gc.collect()
+    await asyncio.sleep(0.5)
+    rss_before = server.memory_info().rss
+    conns = []
+    t0 = time.monotonic()
+    client = legacy_client if mode == "queue" else mux_client
+    for i in range(clients):
+        await client(base, job_ids[i * jobs:(i + 1) * jobs], conns)
+    connect_s = time.monotonic() - t0
+    await asyncio.sleep(0.5)
+    rss_after = server.memory_info().rss
+    sockets = len(server.net_connections(kind="tcp")) if hasattr(server, "net_connections") else len(server.connections())
+
+    for ws in conns:
+        await ws.close()
+    worker.cancel()
+
+    return {
+        "mode": mode,
+        "clients": clients,
+        "jobs_per_client": jobs,
+        "client_sockets": len(conns),
+        "server_tcp": sockets,
+        "rss_delta_mib": round((rss_after - rss_before) / 2**20, 2),
+        "rss_per_client_kib": round((rss_after - rss_before) / clients / 1024, 1),
+        "connect_s": round(connect_s, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--jobs", type=int, default=5, help="jobs watched by each client")
+    args = parser.parse_args()
+    for mode in ("queue", "status"):
+        print(json.dumps(await run(mode, args.clients, args.jobs)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())